@@ -1,17 +1,26 @@
 from functools import total_ordering
-from typing import List
+from typing import IO, Iterator, List
 
 
 class BazelBuild:
     def __init__(self):
         self.bazelTargets = []
 
-    def genBazelBuildContent(self) -> str:
-        content = []
+    def iterBazelBuildContent(self) -> Iterator[str]:
+        # One chunk per target, the chunks are separated by an empty line
+        first = True
         for t in self.bazelTargets:
-            content.extend(t.asBazel())
-            content.append("")
-        return "\n".join(content)
+            if not first:
+                yield "\n"
+            first = False
+            yield "\n".join(t.asBazel()) + "\n"
+
+    def writeBazelBuildContent(self, file: IO[str]):
+        for chunk in self.iterBazelBuildContent():
+            file.write(chunk)
+
+    def genBazelBuildContent(self) -> str:
+        return "".join(self.iterBazelBuildContent())
 
 
 @total_ordering
@@ -1,19 +1,38 @@
 import logging
 import os
 import re
-from typing import List
+from functools import lru_cache
+from typing import FrozenSet, List
+
+HEADER_EXTENSIONS = (".h", ".hpp")
+INCLUDE_DIR_REGEX = re.compile(r"-I([^ ](?:[^ ]|(?: (?!(?:-I)|$)))+)")
+INCLUDE_LINE_REGEX = re.compile(r'#include ((?:<|").*(?:>|"))')
 
 
 def findAllHeaderFiles(current_dir: str) -> List[str]:
-    for dirpath, dirname, files in os.walk(current_dir):
-        for f in files:
-            if f.endswith(".h") or f.endswith(".hpp"):
-                yield (f"{dirpath}/{f}")
+    # os.scandir() gives us the entry type from the directory read so we
+    # don't need an extra stat() per file like os.walk() does, and we can
+    # filter on the name before building the full path
+    # Like os.walk() a directory that is missing or can't be read (a bad -I
+    # for instance) is skipped
+    try:
+        with os.scandir(current_dir) as it:
+            entries = list(it)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from findAllHeaderFiles(f"{current_dir}/{entry.name}")
+        elif entry.name.endswith(HEADER_EXTENSIONS):
+            yield (f"{current_dir}/{entry.name}")
 
 
-def parseIncludes(includes: str) -> List[str]:
-    matches = re.findall(r"-I([^ ](?:[^ ]|(?: (?!(?:-I)|$)))+)", includes)
-    return set(matches)
+# The same INCLUDES string is shared by all the builds of a target and
+# findIncludes() is called again for every header found, parse it only once
+@lru_cache(maxsize=None)
+def parseIncludes(includes: str) -> FrozenSet[str]:
+    matches = INCLUDE_DIR_REGEX.findall(includes)
+    return frozenset(matches)
 
 
 def findIncludes(name: str, includes: str) -> List[str]:
@@ -22,12 +41,12 @@ def findIncludes(name: str, includes: str) -> List[str]:
     else:
         includes_dirs = []
     current_dir = os.path.dirname(os.path.abspath(name))
-    logging.debug(f"Handling findIncludes {name}")
+    logging.debug("Handling findIncludes %s", name)
     with open(name, "r") as f:
         content = f.readlines()
     ret = []
     for line in content:
-        match = re.match(r'#include ((?:<|").*(?:>|"))', line)
+        match = INCLUDE_LINE_REGEX.match(line)
         if not match:
             continue
         current_include = match.group(1)
@@ -35,7 +54,7 @@ def findIncludes(name: str, includes: str) -> List[str]:
         if current_include.startswith('"'):
             full_file_name = f"{current_dir}/{file}"
             if os.path.exists(full_file_name):
-                logging.debug(f"Found {file} in the same directory as the looked file")
+                logging.debug("Found %s in the same directory as the looked file", file)
                 ret.append(full_file_name)
                 ret.extend(findIncludes(full_file_name, includes))
             else:
@@ -45,7 +64,7 @@ def findIncludes(name: str, includes: str) -> List[str]:
                     full_file_name = f"{current_dir}/{d}/{file}"
                     if not os.path.exists(full_file_name):
                         continue
-                    logging.debug(f"Found {file} in the includes variable")
+                    logging.debug("Found %s in the includes variable", file)
                     ret.append(full_file_name)
                     ret.extend(findIncludes(full_file_name, includes))
                     break
@@ -54,7 +73,7 @@ def findIncludes(name: str, includes: str) -> List[str]:
                 full_file_name = f"{current_dir}/{d}/{file}"
                 if not os.path.exists(full_file_name):
                     continue
-                logging.debug(f"Found {file} in the includes variable")
+                logging.debug("Found %s in the includes variable", file)
                 ret.append(full_file_name)
                 ret.extend(findIncludes(full_file_name, includes))
                 break
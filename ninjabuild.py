@@ -1,39 +1,93 @@
+import hashlib
+import json
 import logging
 import os
+import pickle
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from functools import total_ordering
-from typing import Any, Callable, Dict, List, Optional
+from operator import attrgetter
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 from bazel import BazelBuild, BazelTarget
-from cppfileparser import findAllHeaderFiles, findIncludes
-
-IGNORED_STANZA = [
-    "ninja_required_version",
-    "default",
-]
-IGNORED_TARGETS = [
-    "edit_cache",
-    "rebuild_cache",
-    "clean",
-    "help",
-    "install",
-    "build.ninja",
-    "list_install_components",
-    "install/local",
-    "install/strip",
-]
+from cppfileparser import HEADER_EXTENSIONS, findAllHeaderFiles, findIncludes
+
+IGNORED_STANZA = frozenset(
+    [
+        "ninja_required_version",
+        "default",
+    ]
+)
+IGNORED_TARGETS = frozenset(
+    [
+        "edit_cache",
+        "rebuild_cache",
+        "clean",
+        "help",
+        "install",
+        "build.ninja",
+        "list_install_components",
+        "install/local",
+        "install/strip",
+    ]
+)
+ALL_TARGET_NAMES = frozenset(["all"])
+# Below this number of sources it's not worth starting threads to scan them
+PARALLEL_FINALIZE_HEADERS_THRESHOLD = 16
+VARIABLE_REGEX = re.compile(r"\$\{?([\w+]+)\}?")
+LINE_SPLIT_REGEX = re.compile(r" (?!\$)")
+# $VAR in the commands of compile_commands.json, unlike VARIABLE_REGEX a + is
+# not part of the name so that $FLAGS+extra expands FLAGS
+COMMAND_VARIABLE_REGEX = re.compile(r"\$\{?(\w+)\}?")
+# The default filesystems of these platforms ignore the case of the names, a
+# name missing from a directory listing can still exist with another case.
+# Case insensitive directories on other platforms (casefold on Linux) are
+# not handled, a name has to match the listing exactly there
+CASE_INSENSITIVE_FILESYSTEM = sys.platform in ("darwin", "win32", "cygwin")
+# Content of a ninja file, either as a list of lines or as a seekable file
+NinjaInput = Union[Sequence[str], TextIO]
+# Ninja files are read line by line, a big buffer keeps the number of read()
+# calls low on generated files that are hundreds of MB
+NINJA_READ_BUFFER_SIZE = 1 << 20
+# Part of the key of the parse cache entries, bump it whenever the pickled
+# state of NinjaParser changes so that older entries are not loaded
+PARSE_CACHE_VERSION = 2
 
 
 @total_ordering
 class BuildTarget:
+    __slots__ = (
+        "name",
+        "producedby",
+        "usedbybuilds",
+        "is_a_file",
+        "unknown_producer",
+        "headers",
+    )
+
     def __init__(self, name: str):
-        self.name = name
+        # The same paths show up as inputs of many builds, interning them lets
+        # all the targets share one string and makes dict lookups cheaper
+        self.name = sys.intern(name)
         self.producedby: Optional["Build"] = None
         self.usedbybuilds: List["Build"] = []
         self.is_a_file = False
         self.unknown_producer = False
-        self.headers = None
+        self.headers: Optional[List[str]] = None
 
     def __hash__(self) -> int:
         return self.name.__hash__()
@@ -44,13 +98,13 @@ class BuildTarget:
     def __lt__(self, other) -> bool:
         return self.name < other.name
 
-    def setHeadersFiles(self, files: List[str]):
+    def setHeadersFiles(self, files: List[str]) -> None:
         self.headers = files
 
-    def markAsUnknown(self):
+    def markAsUnknown(self) -> None:
         self.unknown_producer = True
 
-    def markAsknown(self):
+    def markAsknown(self) -> None:
         self.unknown_producer = False
 
     def __repr__(self) -> str:
@@ -69,19 +123,19 @@ class BuildTarget:
         self.is_a_file = True
         return self
 
-    def isOnlyUsedBy(self, targetsName: list[str]) -> bool:
+    def isOnlyUsedBy(self, targetsName: Collection[str]) -> bool:
         if len(self.usedbybuilds) == 0:
             return False
-        count = 0
+        # Stop at the first build using us that doesn't produce one of the
+        # targets, pass a set to make the name check a hash lookup
         for e in self.usedbybuilds:
-            for b in e.outputs:
-                if str(b) in targetsName:
-                    count += 1
-        return count == len(self.usedbybuilds)
+            if not any(b.name in targetsName for b in e.outputs):
+                return False
+        return True
 
     def depsAreVirtual(self) -> bool:
         if self.is_a_file:
-            logging.debug(f"{self} is a file")
+            logging.debug("%s is a file", self)
             return False
 
         if self.producedby is None and not self.is_a_file:
@@ -109,94 +163,126 @@ class BuildTarget:
         visitor: Callable[["BuildTarget", Dict[str, Any]], bool],
         ctx: Dict[str, Any],
     ):
-        # If we are visiting a target that is a file ord
-        # a target that is produced by something that is either not phony
-        # of is phony but has real inputs / deps
-        if self.is_a_file or not (
-            self.producedby
-            and self.producedby.rulename.name == "phony"
-            and len(self.producedby.inputs) == 0
-            and len(self.producedby.depends) == 0
-        ):
-            visitor(self, ctx)
-        if self.producedby:
-            for e in sorted(self.producedby.inputs):
-                newctx = ctx["setup_subcontext"](ctx)
-                e.visitGraph(visitor, newctx)
-            for e in sorted(self.producedby.depends):
-                if not e.depsAreVirtual():
-                    newctx = ctx["setup_subcontext"](ctx)
-                    e.visitGraph(visitor, newctx)
-
-    def printGraph(self, ident: int = 0, file=sys.stdout):
-        def visitor(el: "BuildTarget", ctx: Dict[str, Any]):
-            print(" " * ctx["ident"] + el.name)
-
-        def setup(ctx: Dict[str, Any]):
-            ctx2 = {k: v for k, v in ctx.items()}
-            ctx2["ident"] = ctx2["ident"] + 1
-            return ctx2
+        # Depth first walk with an explicit stack instead of recursion, deep
+        # graphs would otherwise cost a python frame per level.
+        # Each entry carries the context of the parent, the subcontext is only
+        # set up when the child is popped so that it's done in the same order
+        # as a recursive walk would do it
+        stack: List[Tuple["BuildTarget", Dict[str, Any], bool]] = [(self, ctx, False)]
+        while len(stack) > 0:
+            el, elctx, is_child = stack.pop()
+            if is_child:
+                elctx = elctx["setup_subcontext"](elctx)
+            producedby = el.producedby
+            # If we are visiting a target that is a file ord
+            # a target that is produced by something that is either not phony
+            # of is phony but has real inputs / deps
+            if el.is_a_file or not (
+                producedby
+                and producedby.rulename.name == "phony"
+                and len(producedby.inputs) == 0
+                and len(producedby.depends) == 0
+            ):
+                # The visitor returns True when the target was already taken
+                # care of, there is no need to go down its inputs again
+                if visitor(el, elctx):
+                    continue
+            if producedby:
+                children = sorted(producedby.inputs)
+                for e in sorted(producedby.depends):
+                    if not e.depsAreVirtual():
+                        children.append(e)
+                stack.extend((e, elctx, True) for e in reversed(children))
+
+    def printGraph(self, ident: int = 0, file=None):
+        # Same walk as the bazel generation, each level of the graph is
+        # indented by one more space
+        lines = []
+
+        def visitor(el: "BuildTarget", ctx: Dict[str, Any]) -> bool:
+            lines.append(ctx["indent"] + el.name)
+            return False
 
-        ctx = {
-            "ident": ident,
-            "output": file,
-            "setup_subcontext": setup,
-        }
+        def setup(ctx):
+            return {"setup_subcontext": setup, "indent": ctx["indent"] + " "}
 
-        self.visitGraph(visitor, ctx)
+        self.visitGraph(visitor, {"setup_subcontext": setup, "indent": " " * ident})
 
-    def _handleCmdForBazelGen(self, cmd: str, el: "BuildTarget", ctx: Dict[str, Any]):
+        if len(lines) > 0:
+            print("\n".join(lines), file=file)
+
+    def _handleCmdForBazelGen(
+        self, cmd: str, el: "BuildTarget", ctx: Dict[str, Any]
+    ) -> bool:
         if ("c++" in cmd or "g++" in cmd) and "$LINK_FLAGS" in cmd:
-            t = BazelTarget("cc_binary", el.name)
-            ctx["bazelbuild"].bazelTargets.append(t)
-            if ctx["current"] is not None:
-                ctx["current"].addDep(t)
-            ctx["current"] = t
-            return
+            return self._addBazelTarget("cc_binary", el, ctx)
         if ("c++" in cmd or "g++" in cmd) and "-c" in cmd:
             ctx["dest"] = ctx["current"]
             # compilation of a source file to an object file, this is taken care by
             # bazel targets like cc_binary or cc_library
-            return
+            return False
         if "/ar " in cmd:
-            t = BazelTarget("cc_library", el.name)
+            return self._addBazelTarget("cc_library", el, ctx)
+        logging.debug(cmd)
+        return False
+
+    def _addBazelTarget(
+        self, type: str, el: "BuildTarget", ctx: Dict[str, Any]
+    ) -> bool:
+        # Libraries are usually used by more than one binary, the bazel target
+        # is generated the first time and the next users just depend on it
+        seen: Dict[str, BazelTarget] = ctx["seen"]
+        t = seen.get(el.name)
+        if t is not None:
             if ctx["current"] is not None:
                 ctx["current"].addDep(t)
-            ctx["current"] = t
-            ctx["bazelbuild"].bazelTargets.append(t)
-            return
-        logging.debug(cmd)
+            return True
+        t = BazelTarget(type, el.name)
+        seen[el.name] = t
+        ctx["bazelbuild"].bazelTargets.append(t)
+        if ctx["current"] is not None:
+            ctx["current"].addDep(t)
+        ctx["current"] = t
+        return False
 
-    def genBazel(self, bb: BazelBuild, rootdir: str):
-        def visitor(el: "BuildTarget", ctx: Dict[str, Any]):
-            if el.producedby:
-                ctx["producer"] = el.producedby
-                rule = el.producedby.rulename
-                c = rule.vars.get("command")
-                assert c is not None
-                arr = c.split("&&")
-                found = False
-                for cmd in arr:
-                    if "$in" in cmd and ("$out" in cmd or "$TARGET_FILE" in cmd):
-                        found = True
-                        break
-                if not found:
-                    logging.warning(f"Didn't find a valid command in {c}")
+    def genBazel(
+        self,
+        bb: BazelBuild,
+        rootdir: str,
+        seen: Optional[Dict[str, BazelTarget]] = None,
+    ):
+        # seen maps the name of the targets already generated to their bazel
+        # target, pass the same dict when generating more than one top level
+        # so that shared libraries are generated once
+        def visitor(el: "BuildTarget", ctx: Dict[str, Any]) -> bool:
+            producedby = el.producedby
+            if producedby:
+                ctx["producer"] = producedby
+                rule = producedby.rulename
+                cmd = rule.getMainCommand()
+                if cmd is None:
+                    logging.warning(
+                        f"Didn't find a valid command in {rule.vars.get('command')}"
+                    )
                 else:
-                    self._handleCmdForBazelGen(cmd, el, ctx)
+                    return self._handleCmdForBazelGen(cmd, el, ctx)
             else:
-                assert ctx["dest"] is not None
+                dest = ctx["dest"]
+                assert dest is not None
+                rootdir = ctx["rootdir"]
                 logging.debug(ctx["producer"].vars)
-                if el.name.endswith(".h") or el.name.endswith(".hpp"):
-                    ctx["dest"].addHdr(el.name.replace(ctx["rootdir"], ""))
+                if el.name.endswith(HEADER_EXTENSIONS):
+                    dest.addHdr(el.name.removeprefix(rootdir))
                 else:
                     # Not produced aka it's a file
                     # we have to parse the file and see if there is any includes
                     # if it's a "" include then we look first in the path where the file is and then
                     # in the path specified with -I
-                    ctx["dest"].addSrc(el.name.replace(ctx["rootdir"], ""))
+                    dest.addSrc(el.name.removeprefix(rootdir))
+                    addHdr = dest.addHdr
                     for h in el.headers:
-                        ctx["dest"].addHdr(h.replace(ctx["rootdir"], ""))
+                        addHdr(h.removeprefix(rootdir))
+            return False
 
         def setup(ctx):
             ctx2 = {k: v for k, v in ctx.items()}
@@ -205,6 +291,7 @@ class BuildTarget:
         ctx: Dict[str, Any] = {"setup_subcontext": setup}
         ctx["bazelbuild"] = bb
         ctx["current"] = None
+        ctx["seen"] = seen if seen is not None else {}
         if rootdir.endswith("/"):
             ctx["rootdir"] = rootdir
         else:
@@ -217,12 +304,29 @@ class Rule:
     def __init__(self, name: str):
         self.name = name
         self.vars: Dict[str, str] = {}
+        self._mainCommand: Optional[str] = None
+        self._mainCommandResolved = False
+
+    def getMainCommand(self) -> Optional[str]:
+        # A rule is shared by a lot of builds, find the part of the command
+        # that actually turns $in into $out only once
+        if not self._mainCommandResolved:
+            c = self.vars.get("command")
+            assert c is not None
+            for cmd in c.split("&&"):
+                if "$in" in cmd and ("$out" in cmd or "$TARGET_FILE" in cmd):
+                    self._mainCommand = cmd
+                    break
+            self._mainCommandResolved = True
+        return self._mainCommand
 
     def __repr__(self):
         return self.name
 
 
 class Build:
+    __slots__ = ("outputs", "rulename", "inputs", "depends", "vars")
+
     def __init__(
         self: "Build",
         outputs: List[BuildTarget],
@@ -256,37 +360,163 @@ class Build:
 
 class NinjaParser:
     def __init__(self):
-        self.buildEdges = []
-        self.currentBuild = None
-        self.currentRule = None
-        self.buffer = []
-        self.all_outputs = {}
-        self.missing = {}
-        self.vars = {}
-        self.rules = {}
+        self.buildEdges: List[Build] = []
+        self.currentBuild: Optional[Build] = None
+        self.currentRule: Optional[Rule] = None
+        # Pieces of a line continued with a trailing $, None when there is none
+        self.buffer: Optional[List[str]] = None
+        self.all_outputs: Dict[str, BuildTarget] = {}
+        self.missing: Dict[str, BuildTarget] = {}
+        self.vars: Dict[str, str] = {}
+        self.rules: Dict[str, Rule] = {}
         self.rules["phony"] = Rule("phony")
-        self.directories = []
-        self.headers_files = {}
-
-    def markDone(self):
+        self.directories: List[str] = []
+        self.headers_files: Dict[str, List[str]] = {}
+        self.included_files: List[str] = []
+        # Directory -> {entry name: is a directory}, None when the directory
+        # can't be listed, an entry is None when it's a symlink
+        self.dir_entries: Dict[str, Optional[Dict[str, Optional[bool]]]] = {}
+
+    def __getstate__(self):
+        # The build graph is cyclic and deep (target -> build -> targets ...),
+        # pickled as is it recurses once per link and blows the stack on real
+        # projects. Targets and builds are stored flat instead, pointing to
+        # each other by their index, and linked back in __setstate__
+        state = self.__dict__.copy()
+        # The directory listings are only valid for the parse that made them
+        state["dir_entries"] = {}
+
+        targets: List[BuildTarget] = []
+        target_index: Dict[int, int] = {}
+
+        def ref(t: BuildTarget) -> int:
+            i = target_index.get(id(t))
+            if i is None:
+                i = len(targets)
+                target_index[id(t)] = i
+                targets.append(t)
+            return i
+
+        build_index = {id(b): i for i, b in enumerate(self.buildEdges)}
+        state["buildEdges"] = [
+            (
+                [ref(t) for t in b.outputs],
+                b.rulename,
+                [ref(t) for t in b.inputs],
+                [ref(t) for t in b.depends],
+                b.vars,
+            )
+            for b in self.buildEdges
+        ]
+        state["all_outputs"] = {k: ref(t) for k, t in self.all_outputs.items()}
+        state["missing"] = {k: ref(t) for k, t in self.missing.items()}
+        if self.currentBuild is not None:
+            state["currentBuild"] = build_index[id(self.currentBuild)]
+        flat_targets = []
+        for t in targets:
+            producedby = -1
+            if t.producedby is not None:
+                producedby = build_index[id(t.producedby)]
+            flat_targets.append(
+                (
+                    t.name,
+                    producedby,
+                    [build_index[id(b)] for b in t.usedbybuilds],
+                    t.is_a_file,
+                    t.unknown_producer,
+                    t.headers,
+                )
+            )
+        state["targets"] = flat_targets
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        state = state.copy()
+        targets = []
+        for name, _, _, is_a_file, unknown_producer, headers in state["targets"]:
+            t = BuildTarget(name)
+            t.is_a_file = is_a_file
+            t.unknown_producer = unknown_producer
+            t.headers = headers
+            targets.append(t)
+
+        builds = []
+        for outputs, rule, inputs, depends, vars in state["buildEdges"]:
+            # Don't go through __init__, the targets get their links below
+            b = Build.__new__(Build)
+            b.outputs = [targets[i] for i in outputs]
+            b.rulename = rule
+            b.inputs = [targets[i] for i in inputs]
+            b.depends = {targets[i] for i in depends}
+            b.vars = vars
+            builds.append(b)
+
+        for t, (_, producedby, usedby, _, _, _) in zip(targets, state.pop("targets")):
+            if producedby >= 0:
+                t.producedby = builds[producedby]
+            t.usedbybuilds = [builds[i] for i in usedby]
+
+        state["buildEdges"] = builds
+        state["all_outputs"] = {k: targets[i] for k, i in state["all_outputs"].items()}
+        state["missing"] = {k: targets[i] for k, i in state["missing"].items()}
+        if state["currentBuild"] is not None:
+            state["currentBuild"] = builds[state["currentBuild"]]
+        self.__dict__.update(state)
+
+    def markDone(self) -> None:
         # What ever we had so far, we mark at finished
         self.currentBuild = None
         self.currentRule = None
 
-    def _resolveName(self, name: str) -> str:
-        regex = r"\$\{?([\w+]+)\}?"
+    def _listDirectory(self, dirname: str) -> Optional[Dict[str, Optional[bool]]]:
+        if dirname in self.dir_entries:
+            return self.dir_entries[dirname]
+        try:
+            with os.scandir(dirname or ".") as it:
+                entries = {
+                    e.name: None if e.is_symlink() else e.is_dir(follow_symlinks=False)
+                    for e in it
+                }
+        except OSError:
+            entries = None
+        self.dir_entries[dirname] = entries
+        return entries
+
+    def _fileExists(self, path: str) -> bool:
+        dirname, basename = os.path.split(path)
+        entries = None
+        if basename not in ("", ".", ".."):
+            entries = self._listDirectory(dirname)
+        if entries is None or entries.get(basename, False) is None:
+            return os.path.exists(path)
+        if basename not in entries:
+            # The listing is case sensitive, the filesystem might not be
+            return CASE_INSENSITIVE_FILESYSTEM and os.path.exists(path)
+        return True
+
+    def _isDirectory(self, path: str) -> bool:
+        dirname, basename = os.path.split(path)
+        entries = None
+        if basename not in ("", ".", ".."):
+            entries = self._listDirectory(dirname)
+        if entries is None or entries.get(basename, False) is None:
+            return os.path.isdir(path)
+        if basename not in entries:
+            return CASE_INSENSITIVE_FILESYSTEM and os.path.isdir(path)
+        return entries[basename]
 
-        def replacer(match: re.Match):
-            return self.vars.get(match.group(1))
+    def _resolveName(self, name: str) -> str:
+        def replacer(match: re.Match) -> str:
+            return self.vars.get(match.group(1), "")
 
-        return re.sub(regex, replacer, name)
+        return VARIABLE_REGEX.sub(replacer, name)
 
-    def _handleRule(self, arr: List[str]):
-        rule = Rule(arr[1])
+    def _handleRule(self, arr: List[str]) -> None:
+        rule = Rule(sys.intern(arr[1]))
         self.rules[rule.name] = rule
         self.currentRule = rule
 
-    def _handleBuild(self, arr: List[str]):
+    def _handleBuild(self, arr: List[str]) -> None:
         arr.pop(0)
         outputs = []
         raw_inputs: List[str] = []
@@ -311,22 +541,19 @@ class NinjaParser:
                 continue
             target.append(arr[j])
 
-        if rulename == "phony":
-            if len(raw_inputs) == 0:
-                newraw_depends = []
-                for d in raw_depends:
-                    if not os.path.isdir(f"{d}"):
-                        newraw_depends.append(d)
+        # The same input or dependency can be listed more than once, only
+        # resolve it once (and keep the order)
+        if len(raw_inputs) > 1:
+            raw_inputs = list(dict.fromkeys(raw_inputs))
+        if len(raw_depends) > 1:
+            raw_depends = list(dict.fromkeys(raw_depends))
 
-                raw_depends = newraw_depends
+        if rulename == "phony" and len(raw_inputs) == 0:
+            raw_depends[:] = [d for d in raw_depends if not self._isDirectory(d)]
 
         inputs = []
         for s in raw_inputs:
-            if not s.startswith("/"):
-                p = f"{s}"
-            else:
-                p = s
-            if os.path.exists(p):
+            if self._fileExists(s):
                 inputs.append(BuildTarget(s).markAsFile())
             else:
                 v = self.all_outputs.get(s)
@@ -345,17 +572,16 @@ class NinjaParser:
                 self.missing[d] = v
             depends.append(v)
 
-        for i in range(len(outputs)):
-            o = outputs[i]
-            t = self.missing.get(str(o))
+        for i, o in enumerate(outputs):
+            key = o.name
+            t = self.missing.pop(key, None)
             if t is not None:
                 # We need to reconcile t and o
-                del self.missing[str(o)]
                 outputs[i] = t
                 t.markAsknown()
                 o = t
 
-            self.all_outputs[str(o)] = o
+            self.all_outputs[key] = o
         rule = self.rules.get(rulename)
         if rule is None:
             logging.error(f"Coulnd't find a rule called {rulename}")
@@ -365,30 +591,58 @@ class NinjaParser:
         self.currentBuild = build
         self.buildEdges.append(build)
 
-    def handleVariable(self, name: str, value: str):
-        self.vars[name] = value
-        logging.debug(f"Var {name} = {self.vars[name]}")
+    def handleVariable(self, name: str, value: str) -> None:
+        self.vars[sys.intern(name)] = sys.intern(value)
+        logging.debug("Var %s = %s", name, value)
 
-    def handleInfclude(self, arr: List[str]):
+    def handleInfclude(self, arr: List[str]) -> None:
         dir = self.directories[-1]
         filename = f"{dir}{os.path.sep}{arr[0]}"
-        with open(filename, "r") as f:
-            raw_ninja = f.readlines()
-
+        self.included_files.append(filename)
         cur_dir = os.path.dirname(os.path.abspath(filename))
-        self.parse(raw_ninja, cur_dir)
-
-    def finalizeHeaders(self, current_dir: str):
+        # Feed the lines to the parser as they are read, there is no need to
+        # hold the whole included file in memory
+        with open(filename, "r", NINJA_READ_BUFFER_SIZE) as f:
+            self.parse(f, cur_dir)
+
+    def finalizeHeaders(
+        self, current_dir: str, max_workers: Optional[int] = None
+    ) -> None:
+        # The same source file is usually an input of more than one build (and
+        # a build with multiple outputs is seen once per output), scan it only
+        # once for a given set of includes
+        seen: Dict[Tuple[str, Optional[str]], Optional[List[str]]] = {}
+        files: List[Tuple[BuildTarget, Tuple[str, Optional[str]]]] = []
         for t in self.all_outputs.values():
             if not t.producedby:
                 continue
+            includes = t.producedby.vars.get("INCLUDES")
             for i in t.producedby.inputs:
                 if i.is_a_file:
-                    includes = t.producedby.vars.get("INCLUDES")
-                    headers = findIncludes(i.name, includes)
-                    i.setHeadersFiles(headers)
-
-    def parse(self, content: List[str], current_dir: str):
+                    key = (i.name, includes)
+                    seen.setdefault(key, None)
+                    files.append((i, key))
+
+        # Scanning is mostly reading files, let threads overlap the I/O when
+        # asked to and there are enough of them
+        workers = max_workers or 1
+        keys = list(seen.keys())
+        if workers == 1 or len(keys) < PARALLEL_FINALIZE_HEADERS_THRESHOLD:
+            for key in keys:
+                seen[key] = findIncludes(*key)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                names = [k[0] for k in keys]
+                includes_list = [k[1] for k in keys]
+                for key, headers in zip(
+                    keys, executor.map(findIncludes, names, includes_list)
+                ):
+                    seen[key] = headers
+
+        for i, key in files:
+            i.setHeadersFiles(seen[key])
+
+    def parse(self, content: Iterable[str], current_dir: str) -> None:
         self.directories.append(current_dir)
         for line in content:
             line = line.rstrip()
@@ -396,30 +650,24 @@ class NinjaParser:
                 continue
 
             if line.endswith("$"):
-                self.buffer.append(line[:-1])
+                if self.buffer is None:
+                    self.buffer = [line[:-1]]
+                else:
+                    self.buffer.append(line[:-1])
                 continue
 
-            if len(self.buffer) > 0:
+            if self.buffer is not None:
                 self.buffer.append(line)
-                newline = "".join(self.buffer)
-                self.buffer = []
-                line = newline
+                line = "".join(self.buffer)
+                self.buffer = None
 
             if len(line) == 0:
                 self.markDone()
                 continue
 
-            arr = re.split(r" (?!\$)", line)
-
-            if arr[0] == "rule":
-                self._handleRule(arr)
-                continue
-
-            if arr[0] == "build":
-                self._handleBuild(arr)
-                continue
-
-            if line.startswith(" "):
+            if line[0] == " ":
+                # Variables of the current build or rule, there is no need to
+                # tokenize the line for them
                 where = None
                 resolv_vars = False
 
@@ -432,16 +680,29 @@ class NinjaParser:
 
                 if where is not None:
                     # TODO resolve vars with $
-                    v = line.split("=")
-                    key = v.pop(0)
+                    key, _, value = line.partition("=")
                     key = key.strip()
-                    value = "=".join(v)
-                    value.strip()
-                    where.vars[key] = value
+                    # The same variable names (and very often the same values
+                    # like INCLUDES or FLAGS) are repeated for every build
+                    where.vars[sys.intern(key)] = sys.intern(value)
                 else:
                     logging.error(f'Don\'t know how to deal with this line "{line}"')
                 continue
 
+            if "$" in line:
+                # A space followed by a $ is not a separator
+                arr = LINE_SPLIT_REGEX.split(line)
+            else:
+                arr = line.split(" ")
+
+            if arr[0] == "rule":
+                self._handleRule(arr)
+                continue
+
+            if arr[0] == "build":
+                self._handleBuild(arr)
+                continue
+
             if arr[0] in IGNORED_STANZA:
                 continue
 
@@ -453,56 +714,201 @@ class NinjaParser:
                 self.handleInfclude(arr[1:])
                 continue
 
-            logging.debug(f"{line} {len(line)}")
+            logging.debug("%s %d", line, len(line))
         self.directories.pop()
 
 
 def getToplevels(parser: NinjaParser) -> List[BuildTarget]:
     real_top_targets = []
     for o in parser.all_outputs.values():
-        if o.isOnlyUsedBy(["all"]):
-            real_top_targets.append(o)
-            logging.error(o)
-            # logging.debug(f"{o} produced by {o.producedby.rulename}")
+        if len(o.usedbybuilds) != 0:
+            # Something uses this output, it can only be a top level if the
+            # only thing using it is the "all" target
+            if o.isOnlyUsedBy(ALL_TARGET_NAMES):
+                real_top_targets.append(o)
+                logging.error(o)
+                # logging.debug(f"{o} produced by {o.producedby.rulename}")
             continue
-        if str(o) in IGNORED_TARGETS or o.isOnlyUsedBy(IGNORED_TARGETS):
+        if o.name in IGNORED_TARGETS:
             continue
         if o.producedby is not None and o.producedby.rulename.name == "phony":
             # Look at all the phony build outputs
             # if all their inputs are used in another build then it's kind of an alias
             # and so it's not a top level build
-            count = 0
-            for i in o.producedby.inputs:
-                if len(i.usedbybuilds) != 0:
-                    count += 1
-            if count == len(o.producedby.inputs):
+            if all(len(i.usedbybuilds) != 0 for i in o.producedby.inputs):
                 continue
-        if len(o.usedbybuilds) == 0:
-            logging.error(o)
-            # logging.debug(f"{o} produced by {o.producedby.rulename.name}")
-            real_top_targets.append(o)
+        logging.error(o)
+        # logging.debug(f"{o} produced by {o.producedby.rulename.name}")
+        real_top_targets.append(o)
 
     return real_top_targets
 
 
-def getBuildTargets(raw_ninja: List[str], dir: str):
+def _isSeekableFile(raw_ninja: Any) -> bool:
+    seekable = getattr(raw_ninja, "seekable", None)
+    return seekable is not None and seekable()
+
+
+def _rewind(raw_ninja: NinjaInput) -> None:
+    # The ninja content is either a list of lines or a file that we read line
+    # by line, a file has to be put back at its beginning before another pass
+    if not isinstance(raw_ninja, Sequence):
+        raw_ninja.seek(0)
+
+
+def _parseCacheKey(raw_ninja: NinjaInput, dir: str) -> str:
+    h = hashlib.blake2b(f"{PARSE_CACHE_VERSION}:{dir}".encode(), digest_size=16)
+    for line in raw_ninja:
+        h.update(line.encode())
+    _rewind(raw_ninja)
+    return h.hexdigest()
+
+
+def _directoryMtime(dirname: str) -> Optional[int]:
+    try:
+        return os.stat(dirname or ".").st_mtime_ns
+    except OSError:
+        return None
+
+
+def _loadOrParse(raw_ninja: NinjaInput, dir: str) -> NinjaParser:
+    # When NINJA2BAZEL_CACHE_DIR is set we keep the parser state on disk, keyed
+    # by the content of the top level ninja file; the included files are
+    # checked against the mtime they had when the entry was written.
+    # Whether an input is a file on disk is part of the parser state too, so
+    # the mtimes of the directories that were listed to find out are checked
+    # as well: adding or removing a file changes them. A change behind a
+    # symlink or in a directory that couldn't be listed is not detected.
+    cache_dir = os.environ.get("NINJA2BAZEL_CACHE_DIR")
+    if not cache_dir:
+        parser = NinjaParser()
+        parser.parse(raw_ninja, dir)
+        return parser
+
+    cache_file = f"{cache_dir}/{_parseCacheKey(raw_ninja, dir)}.pkl"
+    try:
+        with open(cache_file, "rb") as f:
+            mtimes, dir_mtimes, parser = pickle.load(f)
+        if all(
+            os.path.getmtime(name) == mtime for name, mtime in mtimes.items()
+        ) and all(
+            _directoryMtime(name) == mtime for name, mtime in dir_mtimes.items()
+        ):
+            logging.debug("Using cached parse from %s", cache_file)
+            return parser
+    except Exception as e:
+        # Whatever is wrong with the entry (missing, truncated, written by an
+        # older version...) it's just a cache miss, parse again
+        logging.debug("Ignoring the parse cache in %s: %r", cache_file, e)
+
     parser = NinjaParser()
     parser.parse(raw_ninja, dir)
 
+    tmp_file = f"{cache_file}.{os.getpid()}"
+    try:
+        mtimes = {name: os.path.getmtime(name) for name in parser.included_files}
+        dir_mtimes = {name: _directoryMtime(name) for name in parser.dir_entries}
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_file, "wb") as f:
+            pickle.dump(
+                (mtimes, dir_mtimes, parser), f, protocol=pickle.HIGHEST_PROTOCOL
+            )
+        os.replace(tmp_file, cache_file)
+    except (OSError, pickle.PicklingError, RecursionError) as e:
+        logging.warning("Couldn't save the parse cache in %s: %s", cache_file, e)
+    finally:
+        try:
+            os.unlink(tmp_file)
+        except OSError:
+            pass
+
+    return parser
+
+
+def _emitCompileCommands(parser: NinjaParser, dir: str, out_path: str) -> None:
+    # Dump the compilation edges we already parsed in the compile_commands.json
+    # format so that IDEs / language servers don't have to parse ninja again
+    entries = []
+    for build in parser.buildEdges:
+        command = build.rulename.vars.get("command")
+        if command is None or "$LINK_FLAGS" in command:
+            continue
+        if "-c" not in command.split():
+            continue
+
+        def replacer(match: re.Match) -> str:
+            name = match.group(1)
+            if name == "in":
+                return " ".join([i.name for i in build.inputs])
+            if name == "out":
+                return " ".join([o.name for o in build.outputs])
+            value = build.vars.get(name, parser.vars.get(name, ""))
+            return value.strip()
+
+        expanded = COMMAND_VARIABLE_REGEX.sub(replacer, command).strip()
+        for i in build.inputs:
+            entries.append({"directory": dir, "command": expanded, "file": i.name})
+
+    with open(out_path, "w") as f:
+        json.dump(entries, f, indent=2)
+
+
+def getBuildTargets(
+    raw_ninja: Iterable[str], dir: str, max_workers: Optional[int] = None
+) -> Optional[List[BuildTarget]]:
+    # The content is read more than once (build statement check, cache key,
+    # parse). A seekable file is streamed and rewound between the passes,
+    # anything else that can only be iterated once (a generator, stdin ...)
+    # is turned into a list first
+    if not isinstance(raw_ninja, Sequence) and not _isSeekableFile(raw_ninja):
+        raw_ninja = list(raw_ninja)
+
+    # Without a build statement or an include that could bring one there is
+    # nothing to convert, don't bother setting up the parser
+    if not any(line.startswith(("build ", "include ")) for line in raw_ninja):
+        logging.info("No build statements, skipping parse")
+        return []
+    _rewind(raw_ninja)
+
+    parser = _loadOrParse(raw_ninja, dir)
+
     if len(parser.missing) != 0:
         logging.error(
-            f"Something is wrong there is {len(parser.missing)} missing dependencies: {parser.missing}"
+            "Something is wrong there is %d missing dependencies: %s",
+            len(parser.missing),
+            parser.missing,
         )
         return
 
     top_levels = getToplevels(parser)
-    parser.finalizeHeaders(dir)
+    parser.finalizeHeaders(dir, max_workers)
+
+    compile_commands = os.environ.get("NINJA2BAZEL_COMPILE_COMMANDS")
+    if compile_commands:
+        _emitCompileCommands(parser, dir, compile_commands)
+
     return top_levels
 
 
-def genBazelBuildFiles(top_levels: list[BuildTarget], rootdir: str) -> str:
+def _genBazelBuild(top_levels: list[BuildTarget], rootdir: str) -> BazelBuild:
     bb = BazelBuild()
-    for e in sorted(top_levels):
-        e.genBazel(bb, rootdir)
+    # Sort on the name directly, it's what __lt__ compares but without going
+    # through total_ordering for each comparison
+    targets = sorted(top_levels, key=attrgetter("name"))
+    # The top levels share their libraries, generate them in one pass so that
+    # a library already generated is only added as a dependency
+    seen: Dict[str, BazelTarget] = {}
+    for e in targets:
+        e.genBazel(bb, rootdir, seen)
+
+    return bb
+
+
+def genBazelBuildFiles(top_levels: list[BuildTarget], rootdir: str) -> str:
+    return _genBazelBuild(top_levels, rootdir).genBazelBuildContent()
+
 
-    return bb.genBazelBuildContent()
+def writeBazelBuildFiles(top_levels: list[BuildTarget], rootdir: str, file: IO[str]):
+    # Same as genBazelBuildFiles() but the content is written target by target
+    # instead of being assembled in memory first
+    _genBazelBuild(top_levels, rootdir).writeBazelBuildContent(file)
@@ -3,24 +3,29 @@ import logging
 import os
 import sys
 
-from ninjabuild import genBazelBuildFiles, getBuildTargets
+from ninjabuild import (
+    NINJA_READ_BUFFER_SIZE,
+    getBuildTargets,
+    writeBazelBuildFiles,
+)
+from settings import getJobs, getLogLevel
 
 
 def main():
-    logging.basicConfig(level=logging.DEBUG)
+    level, invalid = getLogLevel()
+    logging.basicConfig(level=level)
+    if invalid is not None:
+        logging.warning("Unknown NINJA2BAZEL_LOG_LEVEL %r, using DEBUG", invalid)
     if len(sys.argv) > 2:
         filename = sys.argv[1]
         rootdir = sys.argv[2]
     else:
         logging.fatal("Ninja build input file is missing")
         sys.exit(-1)
-    with open(filename, "r") as f:
-        raw_ninja = f.readlines()
-
     cur_dir = os.path.dirname(os.path.abspath(filename))
-    top_levels_targets = getBuildTargets(raw_ninja, cur_dir)
-    output = genBazelBuildFiles(top_levels_targets, rootdir)
-    print(output)
+    with open(filename, "r", NINJA_READ_BUFFER_SIZE) as f:
+        top_levels_targets = getBuildTargets(f, cur_dir, getJobs())
+    writeBazelBuildFiles(top_levels_targets, rootdir, sys.stdout)
 
 
 if __name__ == "__main__":
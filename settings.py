@@ -0,0 +1,34 @@
+import logging
+import os
+from typing import Optional, Tuple
+
+
+def getLogLevel() -> Tuple[int, Optional[str]]:
+    # Debug logging prints a line for pretty much every node of the graph, on
+    # big builds it can be turned down with NINJA2BAZEL_LOG_LEVEL=INFO.
+    # Returns the level and the value of the variable if it's not a valid one
+    value = os.environ.get("NINJA2BAZEL_LOG_LEVEL")
+    if not value:
+        return logging.DEBUG, None
+    # getLevelName() maps a known name to its level and returns a "Level x"
+    # string otherwise
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        return logging.DEBUG, value
+    return level, None
+
+
+def getJobs() -> int:
+    # Number of threads used to scan the sources for their headers, it's
+    # serial unless NINJA2BAZEL_JOBS asks for more
+    value = os.environ.get("NINJA2BAZEL_JOBS")
+    if not value:
+        return 1
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        logging.warning("Invalid NINJA2BAZEL_JOBS value %r, running serially", value)
+        return 1
+    return jobs
@@ -1,3 +1,4 @@
+import io
 import os
 import sys
 import unittest
@@ -181,6 +182,40 @@ class TestBazelTests(unittest.TestCase):
             ],
         )
 
+    def testWriteBazelBuildContent(self):
+        b = BazelTarget("cc_library", "foo")
+        b.addSrc("foo/bar/baz.c")
+        b2 = BazelTarget("cc_binary", "bar")
+        b2.addSrc("foo/bar/foo.c")
+        b2.addDep(b)
+
+        bz = BazelBuild()
+        bz.bazelTargets.extend([b2, b])
+        expected = [
+            "cc_binary(",
+            '    name = "bar",',
+            "    srcs = [",
+            '        "foo/bar/foo.c",',
+            "    ],",
+            "    deps = [",
+            '        ":libfoo",',
+            "    ],",
+            ")",
+            "",
+            "cc_library(",
+            '    name = "libfoo",',
+            "    srcs = [",
+            '        "foo/bar/baz.c",',
+            "    ],",
+            ")",
+            "",
+        ]
+        out = io.StringIO()
+        bz.writeBazelBuildContent(out)
+        self.assertEqual(out.getvalue(), "\n".join(expected))
+        self.assertEqual(bz.genBazelBuildContent(), "\n".join(expected))
+        self.assertEqual(BazelBuild().genBazelBuildContent(), "")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,11 @@
 import os
 import sys
+import tempfile
 import unittest
 from unittest.mock import mock_open, patch
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cppfileparser import findAllHeaderFiles  # noqa: E402
 from cppfileparser import findIncludes, parseIncludes  # noqa: E402
 
 
@@ -226,6 +228,45 @@ class FindIncludesTestCase(unittest.TestCase):
         self.assertEqual(expected_result, result)
 
 
+class FindAllHeaderFilesTestCase(unittest.TestCase):
+    def test_find_headers_recursively(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(f"{tmpdir}/sub/subsub")
+            for f in ["a.h", "a.cpp", "sub/b.hpp", "sub/b.c", "sub/subsub/c.h"]:
+                with open(f"{tmpdir}/{f}", "w"):
+                    pass
+
+            result = sorted(findAllHeaderFiles(tmpdir))
+
+        expected_result = [
+            f"{tmpdir}/a.h",
+            f"{tmpdir}/sub/b.hpp",
+            f"{tmpdir}/sub/subsub/c.h",
+        ]
+        self.assertEqual(expected_result, result)
+
+    def test_skip_unreadable_directories(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(f"{tmpdir}/sub")
+            for f in ["a.h", "sub/b.h"]:
+                with open(f"{tmpdir}/{f}", "w"):
+                    pass
+
+            self.assertEqual([], list(findAllHeaderFiles(f"{tmpdir}/nothere")))
+
+            real_scandir = os.scandir
+
+            def scandir(path):
+                if path.endswith("/sub"):
+                    raise PermissionError(path)
+                return real_scandir(path)
+
+            with patch("os.scandir", side_effect=scandir):
+                result = list(findAllHeaderFiles(tmpdir))
+
+        self.assertEqual([f"{tmpdir}/a.h"], result)
+
+
 #
 # Add more test cases as needed...
 
@@ -6,11 +6,12 @@ from unittest.mock import MagicMock, Mock, call, patch
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from ninjabuild import Rule  # noqa: E402
 from ninjabuild import Build, BuildTarget, genBazelBuildFiles, getBuildTargets
+from bazel import BazelBuild  # noqa: E402
 
 
 class TestVisitGraph(unittest.TestCase):
     def setUp(self):
-        self.mock_visitor = Mock()
+        self.mock_visitor = Mock(return_value=False)
         self.mock_context = {"setup_subcontext": Mock(return_value="subcontext")}
 
     def test_visit_graph_with_file(self):
@@ -58,23 +59,24 @@ class TestVisitGraph(unittest.TestCase):
         build_target.is_a_file = False
         b = Build([build_target], Rule("phony"), [], [])
         build_target.producedby = b
-        build_target.producedby.inputs = [
-            Mock(name="pouet", depsAreVirtual=Mock(return_value=False))
-        ]
-        build_target.producedby.depends = [
-            Mock(depsAreVirtual=Mock(return_value=False))
-        ]
+        input_target = BuildTarget("pouet").markAsFile()
+        dep_target = BuildTarget("dep").markAsFile()
+        build_target.producedby.inputs = [input_target]
+        build_target.producedby.depends = [dep_target]
 
         build_target.visitGraph(self.mock_visitor, self.mock_context)
 
-        self.mock_visitor.assert_called_once_with(build_target, self.mock_context)
         self.assertEqual(
-            build_target.producedby.inputs[0].visitGraph.call_args_list,
-            [call(self.mock_visitor, "subcontext")],
+            self.mock_visitor.call_args_list,
+            [
+                call(build_target, self.mock_context),
+                call(input_target, "subcontext"),
+                call(dep_target, "subcontext"),
+            ],
         )
         self.assertEqual(
-            build_target.producedby.depends[0].visitGraph.call_args_list,
-            [call(self.mock_visitor, "subcontext")],
+            self.mock_context["setup_subcontext"].call_args_list,
+            [call(self.mock_context), call(self.mock_context)],
         )
 
     def test_visit_graph_with_phony_rule_depends_produced_empty_inputs_and_depends(
@@ -89,31 +91,67 @@ class TestVisitGraph(unittest.TestCase):
         b2 = Build([build_target2], Rule("phony"), [], [build_target])
         build_target2.is_a_file = False
         build_target2.producedby = b2
-        build_target2.producedby.inputs = [
-            Mock(name="pouet", depsAreVirtual=Mock(return_value=False))
-        ]
-        b3 = Build([], Rule("phony"), [], [])
-        build_target.producedby.depends = [
-            Mock(
-                depsAreVirtual=Mock(return_value=False),
-                producedby=b3,
-            )
-        ]
+        input_target = BuildTarget("pouet").markAsFile()
+        build_target2.producedby.inputs = [input_target]
+        virtual_target = BuildTarget("virtual")
+        b3 = Build([virtual_target], Rule("phony"), [], [])
+        virtual_target.producedby = b3
+        build_target.producedby.depends = [virtual_target]
 
         def foo(x):
             return x
 
         build_target2.visitGraph(self.mock_visitor, {"setup_subcontext": foo})
 
-        self.mock_visitor.assert_called_with(build_target2, {"setup_subcontext": foo})
+        # build_target only depends on a virtual target, it's not visited
         self.assertEqual(
-            build_target2.producedby.inputs[0].visitGraph.call_args_list,
-            [call(self.mock_visitor, {"setup_subcontext": foo})],
+            self.mock_visitor.call_args_list,
+            [
+                call(build_target2, {"setup_subcontext": foo}),
+                call(input_target, {"setup_subcontext": foo}),
+            ],
         )
-        self.assertEqual(
-            build_target.producedby.depends[0].visitGraph.call_args_list,
-            [],
+
+    def test_visit_graph_skip_visited(self):
+        # When the visitor returns True the inputs of the target are skipped
+        top = BuildTarget("top")
+        lib = BuildTarget("lib")
+        src = BuildTarget("src").markAsFile()
+        Build([lib], Rule("ar"), [src], [])
+        Build([top], Rule("link"), [lib], [])
+        visited = []
+
+        def visitor(el, ctx):
+            visited.append(el.name)
+            return el.name == "lib"
+
+        top.visitGraph(visitor, {"setup_subcontext": dict})
+
+        self.assertEqual(visited, ["top", "lib"])
+
+    def test_visit_graph_order_and_subcontext(self):
+        # a -> (b -> (d), c), children are visited in sorted order with a
+        # subcontext of their parent's context, like a recursive walk would do
+        targets = {n: BuildTarget(n) for n in "abcd"}
+        targets["d"].markAsFile()
+        targets["c"].markAsFile()
+        targets["b"].producedby = Build(
+            [targets["b"]], Rule("cc"), [targets["d"]], []
         )
+        targets["a"].producedby = Build(
+            [targets["a"]], Rule("cc"), [targets["c"], targets["b"]], []
+        )
+        visited = []
+
+        def visitor(el, ctx):
+            visited.append((el.name, ctx["depth"]))
+
+        def setup(ctx):
+            return {**ctx, "depth": ctx["depth"] + 1}
+
+        targets["a"].visitGraph(visitor, {"setup_subcontext": setup, "depth": 0})
+
+        self.assertEqual(visited, [("a", 0), ("b", 1), ("d", 2), ("c", 1)])
 
 
 def mock_isdir_func(dirname: str) -> bool:
@@ -144,7 +182,7 @@ orig_open = open
 
 
 class MyOpen:
-    def __init__(self, filename, mode):
+    def __init__(self, filename, mode, buffering=-1):
         self.filename = filename
         self.mode = mode
         self.file = None
@@ -199,6 +237,36 @@ class TestGetBuildTargets(unittest.TestCase):
         self.current_dir = cur_dir
         self.raw_content = raw_ninja
 
+    def test_parse_file_object(self):
+        with open(f"{self.current_dir}/data/build.ninja", "r") as f:
+            with patch("os.path.exists", side_effect=mock_exists_func), patch(
+                "os.path.isdir", side_effect=mock_isdir_func
+            ), patch("builtins.open", new_callable=MyOpenCM), patch(
+                "ninjabuild.logging"
+            ):
+                levels = getBuildTargets(f, f"{self.current_dir}/data")
+        self.assertEqual(1, len(levels))
+        self.assertEqual("xarexec_fuse", str(levels[0]))
+
+    def test_parse_generator(self):
+        # A generator can only be iterated once, it has to give the same
+        # result as the list of lines
+        with patch("os.path.exists", side_effect=mock_exists_func), patch(
+            "os.path.isdir", side_effect=mock_isdir_func
+        ), patch("builtins.open", new_callable=MyOpenCM), patch("ninjabuild.logging"):
+            levels = getBuildTargets(
+                (line for line in self.raw_content), f"{self.current_dir}/data"
+            )
+        self.assertEqual(1, len(levels))
+        self.assertEqual("xarexec_fuse", str(levels[0]))
+
+    @patch("ninjabuild.NinjaParser")
+    def test_no_build_statements(self, mock_parser):
+        raw = ["# just a comment\n", "\n", "foo = bar\n", "rule cc\n"]
+        levels = getBuildTargets(raw, f"{self.current_dir}/data")
+        self.assertEqual([], levels)
+        mock_parser.assert_not_called()
+
     @patch("ninjabuild.logging")
     def test_parse_simple_file_missing_deps(self, mock_logging):
         levels = getBuildTargets(self.raw_content, f"{self.current_dir}/data")
@@ -251,5 +319,87 @@ cc_library(
         self.assertEqual(expected, c)
 
 
+class TestBuildTarget(unittest.TestCase):
+    def test_is_only_used_by(self):
+        foo = BuildTarget("foo")
+        self.assertFalse(foo.isOnlyUsedBy({"all"}))
+
+        Build([BuildTarget("all")], Rule("phony"), [foo], [])
+        self.assertTrue(foo.isOnlyUsedBy({"all"}))
+
+        Build([BuildTarget("bar"), BuildTarget("all2")], Rule("phony"), [], [foo])
+        self.assertFalse(foo.isOnlyUsedBy({"all"}))
+        self.assertTrue(foo.isOnlyUsedBy({"all", "all2"}))
+
+
+class TestRule(unittest.TestCase):
+    def test_main_command(self):
+        rule = Rule("CUSTOM")
+        rule.vars["command"] = "cd /tmp && /usr/bin/ar qc $TARGET_FILE $in && ranlib"
+        self.assertEqual(" /usr/bin/ar qc $TARGET_FILE $in ", rule.getMainCommand())
+
+    def test_no_main_command(self):
+        rule = Rule("CUSTOM")
+        rule.vars["command"] = "cd /tmp && true"
+        self.assertIsNone(rule.getMainCommand())
+
+
+class TestGenBazelBuildFiles(unittest.TestCase):
+    def _makeBinaries(self, count: int):
+        link = Rule("CXX_EXECUTABLE_LINKER")
+        link.vars["command"] = "/usr/bin/c++ $FLAGS $in -o $TARGET_FILE $LINK_FLAGS"
+        compile = Rule("CXX_COMPILER")
+        compile.vars["command"] = "/usr/bin/c++ $FLAGS -o $out -c $in"
+        binaries = []
+        for i in range(count):
+            src = BuildTarget(f"/root/src{i}.cpp").markAsFile()
+            src.setHeadersFiles([f"/root/src{i}.h"])
+            obj = BuildTarget(f"src{i}.o")
+            Build([obj], compile, [src], [])
+            binary = BuildTarget(f"bin{i}")
+            Build([binary], link, [obj], [])
+            binaries.append(binary)
+        return binaries
+
+    def test_sorted_top_levels(self):
+        binaries = self._makeBinaries(10)
+        bb = BazelBuild()
+        for b in sorted(binaries):
+            b.genBazel(bb, "/root")
+
+        c = genBazelBuildFiles(list(reversed(binaries)), "/root")
+        self.assertEqual(bb.genBazelBuildContent(), c)
+        self.assertIn('name = "bin9"', c)
+        self.assertIn('"src9.h"', c)
+
+    def test_shared_library_generated_once(self):
+        binaries = self._makeBinaries(10)
+        archive = Rule("CXX_STATIC_LIBRARY_LINKER")
+        archive.vars["command"] = "/usr/bin/ar qc $TARGET_FILE $in"
+        # A rule of its own for the library objects, to count their visits
+        compile = Rule("CXX_COMPILER_COMMON")
+        compile.vars["command"] = "/usr/bin/c++ $FLAGS -o $out -c $in"
+        src = BuildTarget("/root/common.cpp").markAsFile()
+        src.setHeadersFiles(["/root/common.h"])
+        obj = BuildTarget("common.o")
+        Build([obj], compile, [src], [])
+        lib = BuildTarget("libcommon.a")
+        Build([lib], archive, [obj], [])
+        for b in binaries:
+            b.producedby.inputs.append(lib)
+            lib.usedby(b.producedby)
+
+        with patch.object(
+            compile, "getMainCommand", wraps=compile.getMainCommand
+        ) as mock_command:
+            c = genBazelBuildFiles(binaries, "/root")
+        # The library is walked below the first binary only, the other ones
+        # just depend on the target generated then
+        self.assertEqual(1, mock_command.call_count)
+        self.assertEqual(1, c.count("cc_library("))
+        self.assertEqual(1, c.count('"common.cpp"'))
+        self.assertEqual(10, c.count('":libcommon",'))
+
+
 if __name__ == "__main__":
     unittest.main()
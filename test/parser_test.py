@@ -1,12 +1,18 @@
 #!/usr/bin/python3
 import contextlib
+import io
+import json
 import os
+import pickle
 import sys
+import tempfile
 import unittest
+from unittest.mock import patch
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from ninjabuild import NinjaParser, getToplevels  # noqa: E402
+from ninjabuild import NinjaParser, _emitCompileCommands  # noqa: E402
+from ninjabuild import _loadOrParse, getToplevels  # noqa: E402
 
 
 class TestParser(unittest.TestCase):
@@ -32,6 +38,8 @@ class TestParser(unittest.TestCase):
         v2 = parser._resolveName("foo${cmake_ninja_workdir}bar")
         self.assertEqual(v, "foobartmp.1STpxdK06d")
         self.assertEqual(v2, "footmp.1STpxdK06dbar")
+        self.assertEqual(parser._resolveName("foo${not_defined}bar"), "foobar")
+        self.assertEqual(parser._resolveName("foobar"), "foobar")
 
     def test_printgraph(self):
         parser = NinjaParser()
@@ -40,6 +48,271 @@ class TestParser(unittest.TestCase):
         with contextlib.redirect_stdout(None):
             top_levels[0].printGraph()
 
+    def test_printgraph_output(self):
+        parser = NinjaParser()
+        parser.parse(self.raw_file, f"{self.current_dir}/data")
+        top_levels = getToplevels(parser)
+        out = io.StringIO()
+        top_levels[0].printGraph(file=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            lines[:6],
+            [
+                "xarexec_fuse",
+                " CMakeFiles/xarexec_fuse.dir/xar/XarExecFuse.cpp.o",
+                "  /testing/xar/XarExecFuse.cpp",
+                "  cmake_object_order_depends_target_xarexec_fuse",
+                "   cmake_object_order_depends_target_Logging",
+                "   cmake_object_order_depends_target_XarHelperLib",
+            ],
+        )
+        self.assertEqual(len(lines), 20)
+        self.assertEqual(lines[-1], "   cmake_object_order_depends_target_XarHelperLib")
+
+    def test_file_exists_uses_directory_listing(self):
+        parser = NinjaParser()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(f"{tmpdir}/subdir")
+            with open(f"{tmpdir}/foo.cpp", "w"):
+                pass
+
+            with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+                self.assertTrue(parser._fileExists(f"{tmpdir}/foo.cpp"))
+                self.assertFalse(parser._fileExists(f"{tmpdir}/bar.cpp"))
+                self.assertTrue(parser._isDirectory(f"{tmpdir}/subdir"))
+                self.assertFalse(parser._isDirectory(f"{tmpdir}/foo.cpp"))
+                self.assertEqual(1, mock_scandir.call_count)
+
+            # Directories that can't be listed fall back to os.path
+            with patch("os.path.exists", return_value=True):
+                self.assertTrue(parser._fileExists(f"{tmpdir}/nothere/foo.cpp"))
+
+            # On case insensitive filesystems a miss is checked with os.path
+            with patch("ninjabuild.CASE_INSENSITIVE_FILESYSTEM", True):
+                with patch("os.path.exists", return_value=True) as mock_exists:
+                    self.assertTrue(parser._fileExists(f"{tmpdir}/FOO.cpp"))
+                    mock_exists.assert_called_once_with(f"{tmpdir}/FOO.cpp")
+                with patch("os.path.isdir", return_value=True):
+                    self.assertTrue(parser._isDirectory(f"{tmpdir}/SUBDIR"))
+            with patch("ninjabuild.CASE_INSENSITIVE_FILESYSTEM", False), patch(
+                "os.path.exists", return_value=True
+            ) as mock_exists:
+                self.assertFalse(parser._fileExists(f"{tmpdir}/FOO.cpp"))
+                mock_exists.assert_not_called()
+
+    def test_duplicated_inputs(self):
+        parser = NinjaParser()
+        parser.parse(
+            [
+                "rule CXX",
+                "  command = c++ -o $out -c $in",
+                "",
+                "build foo.o: CXX foo.cpp bar.cpp foo.cpp || gen gen",
+                "",
+            ],
+            "/nonexistent",
+        )
+        build = parser.all_outputs["foo.o"].producedby
+        self.assertEqual(["foo.cpp", "bar.cpp"], [i.name for i in build.inputs])
+        self.assertEqual(["gen"], [d.name for d in build.depends])
+
+    def test_finalize_headers_threads(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lines = ["rule CXX", "  command = c++ -o $out -c $in", ""]
+            for n in range(20):
+                with open(f"{tmpdir}/src{n}.h", "w"):
+                    pass
+                with open(f"{tmpdir}/src{n}.cpp", "w") as f:
+                    f.write(f'#include "src{n}.h"\n')
+                lines.append(f"build src{n}.o: CXX {tmpdir}/src{n}.cpp")
+                lines.append("")
+
+            parser = NinjaParser()
+            parser.parse(lines, tmpdir)
+            with patch("ninjabuild.ThreadPoolExecutor") as mock_executor:
+                parser.finalizeHeaders(tmpdir, max_workers=1)
+                mock_executor.assert_not_called()
+            sequential = {
+                n: t.producedby.inputs[0].headers for n, t in parser.all_outputs.items()
+            }
+
+            parser = NinjaParser()
+            parser.parse(lines, tmpdir)
+            parser.finalizeHeaders(tmpdir, max_workers=4)
+            threaded = {
+                n: t.producedby.inputs[0].headers for n, t in parser.all_outputs.items()
+            }
+
+        self.assertEqual(sequential, threaded)
+        self.assertEqual([f"{tmpdir}/src7.h"], threaded["src7.o"])
+
+    def test_parse_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with patch.dict(os.environ, {"NINJA2BAZEL_CACHE_DIR": tmpdir}):
+                parser = _loadOrParse(self.raw_file, f"{self.current_dir}/data")
+                self.assertEqual(1, len(os.listdir(tmpdir)))
+                with patch.object(NinjaParser, "parse") as mock_parse:
+                    cached = _loadOrParse(self.raw_file, f"{self.current_dir}/data")
+                    mock_parse.assert_not_called()
+
+        self.assertEqual(parser.all_outputs.keys(), cached.all_outputs.keys())
+        levels = getToplevels(cached)
+        self.assertEqual(1, len(levels))
+        self.assertEqual(str(levels[0]), "xarexec_fuse")
+
+    def test_parse_cache_failed_save(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with patch.dict(os.environ, {"NINJA2BAZEL_CACHE_DIR": tmpdir}), patch(
+                "pickle.dump", side_effect=pickle.PicklingError("nope")
+            ):
+                parser = _loadOrParse(self.raw_file, f"{self.current_dir}/data")
+            # No half written entry is left behind
+            self.assertEqual([], os.listdir(tmpdir))
+        self.assertEqual(1, len(getToplevels(parser)))
+
+    def test_parse_cache_bad_entry(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with patch.dict(os.environ, {"NINJA2BAZEL_CACHE_DIR": tmpdir}):
+                _loadOrParse(self.raw_file, f"{self.current_dir}/data")
+                cache_file = f"{tmpdir}/{os.listdir(tmpdir)[0]}"
+                # An entry in an older format, without the flat targets
+                with open(cache_file, "wb") as f, patch.object(
+                    NinjaParser, "__getstate__", return_value={}
+                ):
+                    pickle.dump(({}, {}, NinjaParser()), f)
+                parser = _loadOrParse(self.raw_file, f"{self.current_dir}/data")
+                self.assertEqual(1, len(getToplevels(parser)))
+
+                with open(cache_file, "wb") as f:
+                    f.write(b"garbage")
+                parser = _loadOrParse(self.raw_file, f"{self.current_dir}/data")
+                self.assertEqual(1, len(getToplevels(parser)))
+
+    def _deepGraph(self, srcdir: str):
+        # 200 libraries each depending on the previous one, and 500 binaries
+        # linking the last one, deep enough to overflow a recursive pickle
+        lines = [
+            "rule CXX",
+            "  command = c++ -o $out -c $in",
+            "",
+            "rule AR",
+            "  command = /usr/bin/ar qc $TARGET_FILE $in",
+            "",
+            "rule LINK",
+            "  command = c++ $in -o $TARGET_FILE $LINK_FLAGS",
+            "",
+        ]
+        for n in range(200):
+            lines.append(f"build lib{n}.o: CXX {srcdir}/lib{n}.cpp")
+            lines.append("")
+            deps = f" | lib{n - 1}.a" if n > 0 else ""
+            lines.append(f"build lib{n}.a: AR lib{n}.o{deps}")
+            lines.append("")
+        for n in range(500):
+            lines.append(f"build bin{n}.o: CXX {srcdir}/bin{n}.cpp")
+            lines.append("")
+            lines.append(f"build bin{n}: LINK bin{n}.o lib199.a")
+            lines.append("")
+        return lines
+
+    def test_parse_cache_deep_graph(self):
+        with tempfile.TemporaryDirectory() as srcdir, tempfile.TemporaryDirectory(
+        ) as tmpdir:
+            for n in range(200):
+                with open(f"{srcdir}/lib{n}.cpp", "w"):
+                    pass
+            lines = self._deepGraph(srcdir)
+            with patch.dict(os.environ, {"NINJA2BAZEL_CACHE_DIR": tmpdir}):
+                parser = _loadOrParse(lines, srcdir)
+                self.assertEqual(1, len(os.listdir(tmpdir)))
+                self.assertTrue(os.listdir(tmpdir)[0].endswith(".pkl"))
+                with patch.object(NinjaParser, "parse") as mock_parse:
+                    cached = _loadOrParse(lines, srcdir)
+                    mock_parse.assert_not_called()
+
+                # A new source file invalidates the entry, the binaries'
+                # sources are now files instead of missing dependencies
+                for n in range(500):
+                    with open(f"{srcdir}/bin{n}.cpp", "w"):
+                        pass
+                # Make sure the change is visible even with coarse timestamps
+                st = os.stat(srcdir)
+                os.utime(srcdir, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+                reparsed = _loadOrParse(lines, srcdir)
+                self.assertEqual(1, len(os.listdir(tmpdir)))
+
+        self.assertEqual(parser.all_outputs.keys(), cached.all_outputs.keys())
+        self.assertEqual(parser.missing.keys(), cached.missing.keys())
+        self.assertEqual(500, len(cached.missing))
+        self.assertEqual(0, len(reparsed.missing))
+        lib = cached.all_outputs["lib199.a"]
+        self.assertEqual(500, len(lib.usedbybuilds))
+        self.assertIs(lib.usedbybuilds[0], cached.all_outputs["bin0"].producedby)
+        self.assertIs(lib.producedby.rulename, cached.rules["AR"])
+        self.assertEqual(["lib198.a"], [d.name for d in lib.producedby.depends])
+        self.assertTrue(cached.all_outputs["lib0.o"].producedby.inputs[0].is_a_file)
+        self.assertEqual(
+            [t.name for t in getToplevels(parser)],
+            [t.name for t in getToplevels(cached)],
+        )
+
+    def test_emit_compile_commands_variable_names(self):
+        parser = NinjaParser()
+        parser.parse(
+            [
+                "rule CXX",
+                "  command = c++ $FLAGS+extra ${DEFINES}x -o $out -c $in",
+                "",
+                "build foo.o: CXX foo.cpp",
+                "  FLAGS = -O2",
+                "  DEFINES = -DFOO",
+                "",
+            ],
+            "/nonexistent",
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _emitCompileCommands(parser, "/src", f"{tmpdir}/compile_commands.json")
+            with open(f"{tmpdir}/compile_commands.json", "r") as f:
+                entries = json.load(f)
+
+        self.assertEqual(
+            "c++ -O2+extra -DFOOx -o foo.o -c foo.cpp", entries[0]["command"]
+        )
+
+    def test_emit_compile_commands(self):
+        parser = NinjaParser()
+        parser.parse(self.raw_file, f"{self.current_dir}/data")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _emitCompileCommands(
+                parser, f"{self.current_dir}/data", f"{tmpdir}/compile_commands.json"
+            )
+            with open(f"{tmpdir}/compile_commands.json", "r") as f:
+                entries = json.load(f)
+
+        # 5 objects are compiled, none of the link / archive steps are there
+        self.assertEqual(5, len(entries))
+        files = sorted([e["file"] for e in entries])
+        self.assertEqual(
+            files,
+            [
+                "/testing/xar/Logging.cpp",
+                "/testing/xar/Logging.cpp",
+                "/testing/xar/XarExecFuse.cpp",
+                "/testing/xar/XarHelpers.cpp",
+                "/testing/xar/XarLinux.cpp",
+            ],
+        )
+        entry = [e for e in entries if e["file"].endswith("XarHelpers.cpp")][0]
+        self.assertEqual(entry["directory"], f"{self.current_dir}/data")
+        self.assertIn("-I/home/mat/Work/xar", entry["command"])
+        self.assertIn("-std=gnu++17", entry["command"])
+        self.assertIn(
+            "-o CMakeFiles/XarHelperLib.dir/xar/XarHelpers.cpp.o -c "
+            "/testing/xar/XarHelpers.cpp",
+            entry["command"],
+        )
+        self.assertNotIn("$", entry["command"])
+
 
 if __name__ == "__main__":
     unittest.main()
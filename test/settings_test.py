@@ -0,0 +1,36 @@
+import logging
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from settings import getJobs, getLogLevel  # noqa: E402
+
+
+class TestSettings(unittest.TestCase):
+    def test_log_level(self):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual((logging.DEBUG, None), getLogLevel())
+        with patch.dict(os.environ, {"NINJA2BAZEL_LOG_LEVEL": "info"}):
+            self.assertEqual((logging.INFO, None), getLogLevel())
+        with patch.dict(os.environ, {"NINJA2BAZEL_LOG_LEVEL": "INFOO"}):
+            self.assertEqual((logging.DEBUG, "INFOO"), getLogLevel())
+        with patch.dict(os.environ, {"NINJA2BAZEL_LOG_LEVEL": "20"}):
+            self.assertEqual((logging.DEBUG, "20"), getLogLevel())
+
+    def test_jobs(self):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(1, getJobs())
+        with patch.dict(os.environ, {"NINJA2BAZEL_JOBS": "4"}):
+            self.assertEqual(4, getJobs())
+        for value in ("four", "0", "-2"):
+            with patch.dict(os.environ, {"NINJA2BAZEL_JOBS": value}), patch(
+                "settings.logging"
+            ) as mock_logging:
+                self.assertEqual(1, getJobs())
+                mock_logging.warning.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()